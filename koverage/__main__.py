@@ -84,6 +84,12 @@ def common_options(func):
             default=False,
             help="Save the (compressed) PAF files",
         ),
+        click.option(
+            "--zstd-level",
+            help="Zstandard compression level for saved PAF files",
+            show_default=True,
+            default=3,
+        ),
         click.option(
             "--bin-width",
             help="Bin width for estimating read depth variance",
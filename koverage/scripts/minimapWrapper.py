@@ -7,15 +7,16 @@ This script will run minimap2 of a sample's reads against the reference FASTA.
 We use a wrapper instead of a snakemake rule to avoid additional read/writes for every sample.
 PAF files of alignments can optionally be saved.
 
-- `worker_mm_to_count_paf_queues` - read minimap2 output and pass to queues for processing and saving PAF
+- `worker_mm_to_count_paf_queues` - read minimap2 output, pass to queue for processing, and write the zstandard-zipped PAF
 - `worker_mm_to_count_queues` - read minimap2 output and pass to queue for processing only
-- `worker_paf_writer` - read minimap2 output from queue and write to zstandard-zipped file
+- `paf_stream_writer` - open a multithreaded zstandard stream writer for saving the PAF
 - `worker_count_and_print` - read minimap2 output from queue, calculate counts, print to output files
 - `build_mm2cmd` - return the minimap2 command based on presence of R2 file
 - `start_workers` - start queues and worker threads
 """
 
 
+import fcntl
 import subprocess
 import threading
 import queue
@@ -27,68 +28,106 @@ import zstandard as zstd
 import pickle
 
 
-def worker_mm_to_count_paf_queues(pipe, count_queue, paf_queue):
-    """Read minimap2 output and slot into queues for collecting coverage counts, and saving the paf file.
+def worker_mm_to_count_paf_queues(pipe, count_queue, paf_writer, read_size=1048576):
+    """Read minimap2 output, slot into the counts queue, and save the paf file.
+
+    Output is read in fixed-size blocks straight from the pipe's file
+    descriptor and split into batches of bytes lines (no trailing newline);
+    per-line reads and decoding are the bottleneck with millions of alignments.
+    Each raw block is also written to the zstd stream writer as-is; libzstd's
+    own worker threads do the compression, so no separate writer thread or
+    queue hop is needed.
 
     Args:
         pipe (pipe): minimap2 pipe for reading
-        count_queue (Queue): queue for putting for counts
-        paf_queue (Queue): queue for putting for saving paf
+        count_queue (Queue): queue for putting batches of bytes lines for counts
+        paf_writer (ZstdCompressionWriter): zstd stream writer for saving the paf
+        read_size (int): number of bytes to read from the pipe at a time
     """
 
-    for line in iter(pipe.stdout.readline, b""):
-        line = line.decode()
-        count_queue.put(line)
-        paf_queue.put(line)
-
-    for q in [count_queue, paf_queue]:
-        q.put(None)
-
-
-def worker_mm_to_count_queues(pipe, count_queue):
+    fd = pipe.stdout.fileno()
+    tail = b""
+    try:
+        while True:
+            buf = os.read(fd, read_size)
+            if not buf:
+                break
+            paf_writer.write(buf)
+            lines = (tail + buf).split(b"\n")
+            tail = lines.pop()
+            if lines:
+                count_queue.put(lines)
+
+        if tail:
+            count_queue.put([tail])
+    finally:
+        # always deliver the sentinel so a crash here can't hang the consumer;
+        # close() flushes the frame and can re-raise a pending I/O error, so
+        # the sentinel must not depend on it
+        try:
+            paf_writer.close()
+        finally:
+            count_queue.put(None)
+
+
+def worker_mm_to_count_queues(pipe, count_queue, read_size=1048576):
     """Read minimap2 output and slot into queues for collecting coverage counts
 
+    Output is read in fixed-size blocks straight from the pipe's file
+    descriptor and split into batches of bytes lines (no trailing newline);
+    per-line reads and decoding are the bottleneck with millions of alignments.
+
     Args:
-    pipe (pipe): minimap2 pipe for reading
-    count_queue (Queue): queue for putting for counts
+        pipe (pipe): minimap2 pipe for reading
+        count_queue (Queue): queue for putting batches of bytes lines for counts
+        read_size (int): number of bytes to read from the pipe at a time
     """
 
-    for line in iter(pipe.stdout.readline, b""):
-        line = line.decode()
-        count_queue.put(line)
-
-    count_queue.put(None)
-
-
-def worker_paf_writer(paf_queue, paf_dir, sample, chunk_size=100):
-    """Read minimap2 output from queue and write to zstd-zipped file
+    fd = pipe.stdout.fileno()
+    tail = b""
+    try:
+        while True:
+            buf = os.read(fd, read_size)
+            if not buf:
+                break
+            lines = (tail + buf).split(b"\n")
+            tail = lines.pop()
+            if lines:
+                count_queue.put(lines)
+
+        if tail:
+            count_queue.put([tail])
+    finally:
+        # always deliver the sentinel so a crash here can't hang the consumer
+        count_queue.put(None)
+
+
+def paf_stream_writer(paf_dir, sample, zstd_level=3):
+    """Open a multithreaded zstd stream writer for saving the paf file
+
+    The whole PAF is compressed into one zstd frame with a 256 KiB writer
+    buffer, as zstd throughput improves markedly with larger chunks.
+    Long-distance matching with a 128 MiB window picks up the repetitive read
+    and contig names that recur far beyond zstd's default window (costs ~128 MiB
+    of compressor memory, and the same on decompression). Compression runs on
+    libzstd's own worker threads (one per logical CPU), outside the GIL.
 
     Args:
-        paf_queue (Queue): queue of minimap2 output for reading
         paf_dir (str): dir for saving paf files
+        sample (str): sample name for the output filename
+        zstd_level (int): zstandard compression level
+
+    Returns:
+        writer (ZstdCompressionWriter): stream writer; closing it closes the output file
     """
 
-    cctx = zstd.ZstdCompressor()
+    cparams = zstd.ZstdCompressionParameters.from_level(
+        zstd_level, window_log=27, enable_ldm=1, threads=-1
+    )
+    cctx = zstd.ZstdCompressor(compression_params=cparams)
     os.makedirs(paf_dir, exist_ok=True)
     output_f = open(os.path.join(paf_dir, sample + ".paf.zst"), "wb")
-    lines = []
-
-    while True:
-        line = paf_queue.get()
-        if line is None:
-            break
-        lines.append(line.encode())
-        if len(lines) >= chunk_size:
-            compressed_chunk = cctx.compress(b"".join(lines))
-            output_f.write(compressed_chunk)
-            lines = []
-
-    if lines:
-        compressed_chunk = cctx.compress(b"".join(lines))
-        output_f.write(compressed_chunk)
-        output_f.flush()
-
-    output_f.close()
+    return cctx.stream_writer(output_f, write_size=262144)
 
 
 def contig_lens_from_fai(file_path):
@@ -116,7 +155,7 @@ def worker_count_and_print(count_queue, contig_lengths, **kwargs):
     """Collect the counts from minimap2 queue and calc counts on the fly
 
     Args:
-        count_queue (Queue): queue of minimap2 output for reading
+        count_queue (Queue): queue of batches of bytes minimap2 output lines for reading
         contig_lengths (list):
             0: Sequence ID (str)
             1: contig length (int)
@@ -124,16 +163,39 @@ def worker_count_and_print(count_queue, contig_lengths, **kwargs):
             - bin_width (int): Width of bins for hitrate and variance estimation
             - output_counts (str): filepath for writing output count stats
     """
+    bin_width = kwargs["bin_width"]
     max_bin = int(max(row[1] for row in contig_lengths))
-    array_shape = (len(contig_lengths), max_bin // kwargs["bin_width"] + 1)
+    array_shape = (len(contig_lengths), max_bin // bin_width + 1)
     contig_bin_counts = np.zeros(array_shape, dtype=np.int32)
+    n_bins = array_shape[1]
+    flat_counts = contig_bin_counts.reshape(-1)
 
+    # pre-bind the lookups resolved on every iteration of the hot loop
+    q_get = count_queue.get
     while True:
-        line = count_queue.get()
-        if line is None:
+        item = q_get()
+        if item is None:
             break
-        l = line.strip().split()
-        contig_bin_counts[int(l[5]), int(int(l[7]) / kwargs["bin_width"])] += 1
+        ids = []
+        positions = []
+        ids_append = ids.append
+        positions_append = positions.append
+        for line in item:
+            l = line.split(b"\t", 8)
+            if len(l) < 8:
+                continue
+            ids_append(int(l[5]))
+            positions_append(int(l[7]))
+        if ids:
+            # accumulate against the flat array: alignments cluster into few
+            # bins per batch, so summing duplicates with np.unique and doing
+            # one add per touched bin beats np.add.at's per-element path
+            idx = (
+                np.asarray(ids, dtype=np.intp) * n_bins
+                + np.asarray(positions, dtype=np.intp) // bin_width
+            )
+            touched, increments = np.unique(idx, return_counts=True)
+            flat_counts[touched] += increments
 
     with open(kwargs["output_counts"], "wb") as handle:
         pickle.dump(contig_lengths, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -162,6 +224,9 @@ def build_mm2cmd(**kwargs):
         "-x",
         kwargs["minimap_mode"],
         "--secondary=no",
+        "-2",
+        "-K",
+        "2G",
         kwargs["ref_idx"],
         kwargs["r1_file"],
     ]
@@ -172,37 +237,38 @@ def build_mm2cmd(**kwargs):
     return mm2cmd
 
 
-def start_workers(queue_counts, queue_paf, pipe_minimap, **kwargs):
-    """Start workers for reading the minimap output and parsing to queue(s) for processing
+def start_workers(queue_counts, pipe_minimap, **kwargs):
+    """Start the worker for reading the minimap output and parsing to queue for processing
 
     Args:
         queue_counts (Queue): queue to use for putting minimap2 output for collecting counts
         pipe_minimap (pipe): subprocess pipe for minimap2 for reading
         **kwargs (dict):
-            - paf_file (str): PAF file for writing
             - save_pafs (bool): flag for if PAF files should be saved
+            - paf_dir (str): dir for saving paf files
+            - sample (str): sample name for the paf filename
+            - zstd_level (int): zstandard compression level for saved PAF files
     """
 
-    thread_parser_paf = None
-
     if kwargs["save_pafs"]:
+        paf_writer = paf_stream_writer(
+            kwargs["paf_dir"], kwargs["sample"], kwargs.get("zstd_level", 3)
+        )
         thread_reader = threading.Thread(
             target=worker_mm_to_count_paf_queues,
-            args=(pipe_minimap, queue_counts, queue_paf),
+            args=(pipe_minimap, queue_counts, paf_writer),
+            daemon=True,
         )
         thread_reader.start()
-        thread_parser_paf = threading.Thread(
-            target=worker_paf_writer,
-            args=(queue_paf, kwargs["paf_dir"], kwargs["sample"]),
-        )
-        thread_parser_paf.start()
     else:
         thread_reader = threading.Thread(
-            target=worker_mm_to_count_queues, args=(pipe_minimap, queue_counts)
+            target=worker_mm_to_count_queues,
+            args=(pipe_minimap, queue_counts),
+            daemon=True,
         )
         thread_reader.start()
 
-    return thread_reader, thread_parser_paf
+    return thread_reader
 
 
 def main(**kwargs):
@@ -229,16 +295,23 @@ def main(**kwargs):
 
     mm2cmd = build_mm2cmd(**kwargs)
     logging.debug("Starting minimap2: " + ' '.join(mm2cmd) + "\n")
+    # bufsize=0: the reader workers pull blocks straight off the descriptor
+    # with os.read, so Python-level buffering would just add a copy
     pipe_minimap = subprocess.Popen(
-        mm2cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        mm2cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
     )
 
+    # Enlarge the OS pipe buffer from the 64 KiB default so minimap2 blocks
+    # less while Python drains it (Linux only; no-op elsewhere)
+    if hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(pipe_minimap.stdout.fileno(), fcntl.F_SETPIPE_SZ, 1048576)
+        except OSError:
+            pass
+
     # Create queue for counts
     queue_counts = queue.Queue()
-    queue_paf = queue.Queue()
-    thread_reader, thread_parser_paf = start_workers(
-        queue_counts, queue_paf, pipe_minimap, **kwargs
-    )
+    thread_reader = start_workers(queue_counts, pipe_minimap, **kwargs)
 
     # Contig IDs and lens from fai
     contig_lens = contig_lens_from_fai(kwargs["ref_fai"])
@@ -251,13 +324,12 @@ def main(**kwargs):
             contig_lens,
         ),
         kwargs=kwargs,
+        daemon=True,
     )
     thread_parser_counts.start()
 
     # wait for workers to finish
     thread_parser_counts.join()
-    if thread_parser_paf:
-        thread_parser_paf.join()
 
     # check minimap2 finished ok
     pipe_minimap.stdout.close()
@@ -267,8 +339,9 @@ def main(**kwargs):
         logging.debug("STDERR: " + pipe_minimap.stderr.read().decode())
         sys.exit(1)
 
-    # Join reader
-    thread_reader.join()
+    # Join reader; bounded since it has already delivered its sentinel by the
+    # time the counter finished, and it is a daemon thread regardless
+    thread_reader.join(timeout=30)
 
 
 if __name__ == "__main__":
@@ -282,6 +355,7 @@ if __name__ == "__main__":
         r2_file=snakemake.params.r2,
         save_pafs=snakemake.params.pafs,
         paf_dir=snakemake.params.paf_dir,
+        zstd_level=snakemake.params.zstd_level,
         sample=snakemake.wildcards.sample,
         bin_width=snakemake.params.bin_width,
         output_counts=snakemake.output.counts,
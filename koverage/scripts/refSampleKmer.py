@@ -84,13 +84,13 @@ def string_to_kmers(seq, **kwargs):
     Returns:
         kmers (list): list of kmers sampled from input contig sequence
     """
-    nkmer = int(len(seq) / kwargs["kspace"])
+    nkmer = len(seq) // kwargs["kspace"]
     imax = len(seq) - (kwargs["ksize"] + 1)
     if nkmer < kwargs["kmin"]:
         nkmer = kwargs["kmin"]
     elif nkmer > kwargs["kmax"]:
         nkmer = kwargs["kmax"]
-    kpad = int(imax / nkmer)
+    kpad = imax // nkmer
     if kpad < 1:
         kpad = 1
     kmers = set()
@@ -35,17 +35,20 @@ def calculate_coverage_stats_from_counts(**kwargs):
     contiglenkb = contiglens / 1000
 
     sums = np.sum(contig_bin_counts, axis=1)
-    means = np.zeros(len(contiglens))
-    medians = np.zeros(len(contiglens))
-    hitrates = np.zeros(len(contiglens))
-    variances = np.zeros(len(contiglens))
-
-    for c in range(len(contiglens)):
-        maxBin = int(contiglens[c] / kwargs["bin_width"])
-        means[c] = np.mean(contig_bin_counts[c, 0:maxBin])
-        medians[c] = np.median(contig_bin_counts[c, 0:maxBin])
-        hitrates[c] = np.sum(contig_bin_counts[c, 0:maxBin] != 0) / maxBin
-        variances[c] = np.var(contig_bin_counts[c, 0:maxBin], ddof=1)
+
+    # mask the padding bins past each contig's last bin, then compute all
+    # contigs' stats in one vectorized pass
+    max_bins = contiglens // kwargs["bin_width"]
+    pad_mask = np.arange(contig_bin_counts.shape[1]) >= max_bins[:, None]
+    masked_counts = np.ma.masked_array(contig_bin_counts, mask=pad_mask)
+
+    means = np.ma.mean(masked_counts, axis=1).filled(0)
+    medians = np.ma.median(masked_counts, axis=1).filled(0)
+    # contigs shorter than bin_width have no whole bins; report zero hitrate
+    # rather than dividing by zero
+    hits = (masked_counts != 0).sum(axis=1).filled(0)
+    hitrates = np.where(max_bins > 0, hits / np.maximum(max_bins, 1), 0)
+    variances = np.ma.var(masked_counts, axis=1, ddof=1).filled(0)
 
     lib_size = np.sum(sums)
     rpmscale = lib_size / 1000000
@@ -59,6 +59,7 @@ rule raw_coverage:
         r2 = lambda wildcards: samples["reads"][wildcards.sample]["R2"] if samples["reads"][wildcards.sample]["R2"] else "",
         pafs = config["args"]["pafs"],
         paf_dir = dir["paf"],
+        zstd_level = config["args"]["zstd_level"],
         bin_width = config["args"]["bin_width"],
         minimap = config["args"]["minimap"],
         # pyspy = config["args"]["pyspy"]
@@ -11,7 +11,7 @@ from unittest.mock import MagicMock, patch, mock_open, call
 from koverage.scripts.minimapWrapper import (
     worker_mm_to_count_paf_queues,
     worker_mm_to_count_queues,
-    worker_paf_writer,
+    paf_stream_writer,
     worker_count_and_print,
     build_mm2cmd,
     start_workers,
@@ -32,14 +32,14 @@ def fasta_lens():
 @pytest.fixture
 def minimap_pipe():
     out = [
-        "col1\tcol2\tcol3\tcol4\tcol5\t0\t50\t25\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t0\t50\t25\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t0\t50\t25\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t1\t125\t25\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t1\t125\t125\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t2\t100\t25\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t2\t100\t25\tcol9\tcol10\tcol11\tcol12\n",
-        "col1\tcol2\tcol3\tcol4\tcol5\t2\t100\t75\tcol9\tcol10\tcol11\tcol12\n",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t0\t50\t25\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t0\t50\t25\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t0\t50\t25\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t1\t125\t25\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t1\t125\t125\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t2\t100\t25\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t2\t100\t25\tcol9\tcol10\tcol11\tcol12",
+        b"col1\tcol2\tcol3\tcol4\tcol5\t2\t100\t75\tcol9\tcol10\tcol11\tcol12",
     ]
     return out
 
@@ -52,92 +52,143 @@ def numpy_count_arr():
 
 def test_worker_mm_to_count_paf_queues():
     count_queue = Queue()
-    paf_queue = Queue()
+    paf_writer = MagicMock()
     pipe = MagicMock()
-    pipe.stdout.readline.side_effect = [
-        b"line1\n",
-        b"line2\n",
-        b"line3\n",
-        b"",
-    ]
-    worker_mm_to_count_paf_queues(pipe, count_queue, paf_queue)
-    assert count_queue.get() == "line1\n"
-    assert paf_queue.get() == "line1\n"
-    assert count_queue.get() == "line2\n"
-    assert paf_queue.get() == "line2\n"
-    assert count_queue.get() == "line3\n"
-    assert paf_queue.get() == "line3\n"
+    pipe.stdout.fileno.return_value = 42
+    with patch("os.read") as mock_read:
+        mock_read.side_effect = [
+            b"line1\nline2\nline3\n",
+            b"",
+        ]
+        worker_mm_to_count_paf_queues(pipe, count_queue, paf_writer)
+    assert count_queue.get() == [b"line1", b"line2", b"line3"]
+    assert count_queue.get() is None
+    paf_writer.write.assert_called_once_with(b"line1\nline2\nline3\n")
+    paf_writer.close.assert_called_once()
+
+
+def test_worker_mm_to_count_paf_queues_split_lines():
+    count_queue = Queue()
+    paf_writer = MagicMock()
+    pipe = MagicMock()
+    pipe.stdout.fileno.return_value = 42
+    with patch("os.read") as mock_read:
+        mock_read.side_effect = [
+            b"line1\nli",
+            b"ne2\nline3",
+            b"",
+        ]
+        worker_mm_to_count_paf_queues(pipe, count_queue, paf_writer, read_size=10)
+    assert count_queue.get() == [b"line1"]
+    assert count_queue.get() == [b"line2"]
+    assert count_queue.get() == [b"line3"]
+    assert count_queue.get() is None
+    paf_writer.write.assert_has_calls([call(b"line1\nli"), call(b"ne2\nline3")])
+    paf_writer.close.assert_called_once()
+
+
+def test_worker_mm_to_count_paf_queues_sentinel_on_error():
+    count_queue = Queue()
+    paf_writer = MagicMock()
+    # a failed write re-raises from close() too when the frame is flushed
+    paf_writer.write.side_effect = OSError("disk full")
+    paf_writer.close.side_effect = OSError("disk full")
+    pipe = MagicMock()
+    pipe.stdout.fileno.return_value = 42
+    with patch("os.read") as mock_read:
+        mock_read.side_effect = [b"line1\n", b""]
+        with pytest.raises(OSError):
+            worker_mm_to_count_paf_queues(pipe, count_queue, paf_writer)
     assert count_queue.get() is None
-    assert paf_queue.get() is None
+    paf_writer.close.assert_called_once()
 
 
 def test_worker_mm_to_count_queues():
     count_queue = Queue()
     pipe = MagicMock()
-    pipe.stdout.readline.side_effect = [
-        b"line1\n",
-        b"line2\n",
-        b"line3\n",
-        b"",
-    ]
-    worker_mm_to_count_queues(pipe, count_queue)
-    assert count_queue.get() == "line1\n"
-    assert count_queue.get() == "line2\n"
-    assert count_queue.get() == "line3\n"
+    pipe.stdout.fileno.return_value = 42
+    with patch("os.read") as mock_read:
+        mock_read.side_effect = [
+            b"line1\nline2\nline3\n",
+            b"",
+        ]
+        worker_mm_to_count_queues(pipe, count_queue)
+    assert count_queue.get() == [b"line1", b"line2", b"line3"]
     assert count_queue.get() is None
 
 
-def test_worker_paf_writer(tmp_path):
-    paf_queue = Queue()
+def test_worker_mm_to_count_queues_split_lines():
+    count_queue = Queue()
+    pipe = MagicMock()
+    pipe.stdout.fileno.return_value = 42
+    with patch("os.read") as mock_read:
+        mock_read.side_effect = [
+            b"line1\nli",
+            b"ne2\nline3",
+            b"",
+        ]
+        worker_mm_to_count_queues(pipe, count_queue, read_size=10)
+    assert count_queue.get() == [b"line1"]
+    assert count_queue.get() == [b"line2"]
+    assert count_queue.get() == [b"line3"]
+    assert count_queue.get() is None
+
+
+def test_paf_stream_writer(tmp_path):
     paf_dir = tmp_path / "output"
     sample = "sample"
     paf_file = os.path.join(paf_dir, sample + ".paf.zst")
-    paf_queue.put("line1\n")
-    paf_queue.put("line2\n")
-    paf_queue.put("line3\n")
-    paf_queue.put(None)
-    worker_paf_writer(paf_queue, paf_dir, sample)
+    writer = paf_stream_writer(paf_dir, sample)
+    writer.write(b"line1\nline2\n")
+    writer.write(b"line3\n")
+    writer.close()
     with open(paf_file, "rb") as f:
         compressed_content = f.read()
     assert compressed_content.startswith(b"\x28\xb5\x2f\xfd")
-    assert b"line1\nline2\nline3\n" in compressed_content
-
-
-def test_worker_paf_writer_empty_queue(tmp_path):
-    paf_queue = Queue()
-    paf_dir = tmp_path / "output"
-    sample = "sample"
-    paf_file = os.path.join(paf_dir, sample + ".paf.zst")
-    paf_queue.put(None)
-    worker_paf_writer(paf_queue, paf_dir, sample)
-    assert os.stat(paf_file).st_size == 0
+    dctx = zstd.ZstdDecompressor()
+    with open(paf_file, "rb") as in_fh:
+        with dctx.stream_reader(in_fh) as f:
+            assert f.read() == b"line1\nline2\nline3\n"
 
 
-def test_worker_paf_writer_chunksize(tmp_path):
-    paf_queue = Queue()
+def test_paf_stream_writer_empty(tmp_path):
     paf_dir = tmp_path / "output"
     sample = "sample"
     paf_file = os.path.join(paf_dir, sample + ".paf.zst")
-    paf_queue.put("line1\n")
-    paf_queue.put("line2\n")
-    paf_queue.put("line3\n")
-    paf_queue.put(None)
-    worker_paf_writer(paf_queue, paf_dir, sample, chunk_size=2)
+    writer = paf_stream_writer(paf_dir, sample)
+    writer.close()
     dctx = zstd.ZstdDecompressor()
     with open(paf_file, "rb") as in_fh:
         with dctx.stream_reader(in_fh) as f:
-            decompressed_data = f.read()
-    decoded_output = decompressed_data.decode()
-    expected_output = "line1\nline2\nline3\n"
-    assert decoded_output == expected_output
+            assert f.read() == b""
 
 
 def test_worker_count_and_print(tmp_path, fasta_lens, minimap_pipe, numpy_count_arr):
     count_queue = Queue()
     output_counts = tmp_path / "counts.pkl"
 
-    for line in minimap_pipe:
-        count_queue.put(line)
+    count_queue.put(minimap_pipe)
+    count_queue.put(None)
+
+    worker_count_and_print(
+        count_queue, fasta_lens, output_counts=output_counts, bin_width=50
+    )
+
+    with open(output_counts, "rb") as handle:
+        contig_lengths = pickle.load(handle)
+        contig_bin_counts = pickle.load(handle)
+
+    assert contig_lengths == fasta_lens
+    assert_array_equal(contig_bin_counts, numpy_count_arr)
+
+
+def test_worker_count_and_print_short_lines(
+    tmp_path, fasta_lens, minimap_pipe, numpy_count_arr
+):
+    count_queue = Queue()
+    output_counts = tmp_path / "counts.pkl"
+
+    count_queue.put(minimap_pipe + [b"", b"col1\tcol2\tcol3"])
     count_queue.put(None)
 
     worker_count_and_print(
@@ -174,8 +225,7 @@ def test_worker_count_and_print_mock_open(tmp_path, minimap_pipe, fasta_lens):
     count_queue = Queue()
     output_counts = tmp_path / "counts.pkl"
 
-    for line in minimap_pipe:
-        count_queue.put(line)
+    count_queue.put(minimap_pipe)
     count_queue.put(None)
 
     with patch("builtins.open", mock_open()) as mock_file:
@@ -204,6 +254,9 @@ def test_build_mm2cmd():
         "-x",
         "sr",
         "--secondary=no",
+        "-2",
+        "-K",
+        "2G",
         "ref.idx",
         "reads1.fastq",
         "reads2.fastq",
@@ -217,6 +270,9 @@ def test_build_mm2cmd():
         "-x",
         "sr",
         "--secondary=no",
+        "-2",
+        "-K",
+        "2G",
         "ref.idx",
         "reads1.fastq",
     ]
@@ -235,40 +291,49 @@ def test_build_mm2cmd():
         "-x",
         "map-ont",
         "--secondary=no",
+        "-2",
+        "-K",
+        "2G",
         "ref.fa",
         "reads.fq",
     ]
     assert build_mm2cmd(**kwargs) == expected_cmd
 
 
-def test_start_workers_mock_thread():
-    kwargs = {"save_pafs": True, "paf_dir": "output", "sample": "sample"}
+def test_start_workers_mock_thread(tmp_path):
+    kwargs = {"save_pafs": True, "paf_dir": str(tmp_path), "sample": "sample"}
     queue_counts = Queue()
-    paf_queue = Queue()
     pipe_minimap = MagicMock()
     mock_thread_reader = MagicMock()
-    mock_thread_parser_paf = MagicMock()
-    with patch("threading.Thread") as mock_thread:
-        mock_thread.side_effect = [mock_thread_reader, mock_thread_parser_paf]
-        start_workers(queue_counts, paf_queue, pipe_minimap, **kwargs)
+    mock_writer = MagicMock()
+    with patch("threading.Thread") as mock_thread, patch(
+        "koverage.scripts.minimapWrapper.paf_stream_writer"
+    ) as mock_paf_writer:
+        mock_thread.side_effect = [mock_thread_reader]
+        mock_paf_writer.return_value = mock_writer
+        start_workers(queue_counts, pipe_minimap, **kwargs)
+    mock_paf_writer.assert_called_once_with(str(tmp_path), "sample", 3)
     mock_thread.assert_has_calls(
         [
             call(
                 target=worker_mm_to_count_paf_queues,
-                args=(pipe_minimap, queue_counts, paf_queue),
-            ),
-            call(
-                target=worker_paf_writer,
-                args=(paf_queue, kwargs["paf_dir"], kwargs["sample"]),
+                args=(pipe_minimap, queue_counts, mock_writer),
+                daemon=True,
             ),
         ]
     )
     kwargs["save_pafs"] = False
     with patch("threading.Thread") as mock_thread:
-        mock_thread.side_effect = [mock_thread_reader, mock_thread_parser_paf]
-        start_workers(queue_counts, paf_queue, pipe_minimap, **kwargs)
+        mock_thread.side_effect = [mock_thread_reader]
+        start_workers(queue_counts, pipe_minimap, **kwargs)
     mock_thread.assert_has_calls(
-        [call(target=worker_mm_to_count_queues, args=(pipe_minimap, queue_counts))]
+        [
+            call(
+                target=worker_mm_to_count_queues,
+                args=(pipe_minimap, queue_counts),
+                daemon=True,
+            )
+        ]
     )
 
 
@@ -76,6 +76,24 @@ def test_calculate_coverage_stats_from_counts(
     assert actual_output == count_expected_output
 
 
+def test_short_contig_coverage_stats_from_counts(kwarguments):
+    # contig2 is shorter than bin_width (no whole bins): count stats still
+    # apply but mean/median/hitrate/variance report 0
+    contig_lens = [["contig1", 1000], ["contig2", 500]]
+    contig_bin_counts = np.array([[2, 0], [1, 0]], dtype=np.int32)
+    dump_pickle(contig_lens, contig_bin_counts, **kwarguments)
+
+    calculate_coverage_stats_from_counts(**kwarguments)
+
+    with open(kwarguments["output_file"], "r") as output_file:
+        actual_output = output_file.readlines()
+
+    assert actual_output == [
+        "sample1\tcontig1\t2\t6.667e+05\t6.667e+05\t2\t5e+05\t2\t2\t1\t0\n",
+        "sample1\tcontig2\t1\t3.333e+05\t6.667e+05\t2\t5e+05\t0\t0\t0\t0\n",
+    ]
+
+
 def test_empty_coverage_stats_from_counts(contig_lens, kwarguments, count_empty_output):
     contig_bin_counts = np.zeros([3, 10], dtype=np.int32)
     dump_pickle(contig_lens, contig_bin_counts, **kwarguments)